@@ -0,0 +1,76 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled version of the deviation kernel used by FreeThrowAnalyzer, with the same inputs and outputs as
+deviation_function._compute_devs_numpy. Build it in place with
+
+    cythonize -i _devkernel.pyx
+
+and deviation_function picks it up ahead of the Numba and NumPy versions.
+"""
+import numpy as np
+
+from cython cimport floating
+from libc.math cimport sqrt
+
+
+def compute_devs(r_shoulder, l_shoulder, r_elbow, r_wrist, r_hand):
+    # The typed kernel needs all five arrays in one float dtype, so mixed inputs are first cast to their
+    # common dtype, as NumPy would promote them
+    joints = (r_shoulder, l_shoulder, r_elbow, r_wrist, r_hand)
+    dtype = r_shoulder.dtype
+    if not (dtype == l_shoulder.dtype == r_elbow.dtype == r_wrist.dtype == r_hand.dtype) or dtype.kind != "f":
+        dtype = np.result_type(*joints, np.float32)
+        joints = [np.asarray(joint, dtype=dtype) for joint in joints]
+    return _compute_devs_typed(*joints)
+
+
+def _compute_devs_typed(
+    const floating[:, :] r_shoulder,
+    const floating[:, :] l_shoulder,
+    const floating[:, :] r_elbow,
+    const floating[:, :] r_wrist,
+    const floating[:, :] r_hand,
+):
+    cdef Py_ssize_t N_frames = r_shoulder.shape[0]
+    cdef Py_ssize_t i, k
+    cdef double mid, elbow_dev_sq, wrist_dev_sq, hand_dev_sq, elbow_shoulder_sq, wrist_shoulder_sq, hand_shoulder_sq
+
+    dtype = np.float32 if floating is float else np.float64
+    elbow_dev = np.empty(N_frames, dtype=dtype)
+    wrist_dev = np.empty(N_frames, dtype=dtype)
+    hand_dev = np.empty(N_frames, dtype=dtype)
+    elbow_shoulder_dist = np.empty(N_frames, dtype=dtype)
+    wrist_shoulder_dist = np.empty(N_frames, dtype=dtype)
+    hand_shoulder_dist = np.empty(N_frames, dtype=dtype)
+
+    cdef floating[::1] elbow_dev_view = elbow_dev
+    cdef floating[::1] wrist_dev_view = wrist_dev
+    cdef floating[::1] hand_dev_view = hand_dev
+    cdef floating[::1] elbow_shoulder_view = elbow_shoulder_dist
+    cdef floating[::1] wrist_shoulder_view = wrist_shoulder_dist
+    cdef floating[::1] hand_shoulder_view = hand_shoulder_dist
+
+    with nogil:
+        for i in range(N_frames):
+            elbow_dev_sq = 0.0
+            wrist_dev_sq = 0.0
+            hand_dev_sq = 0.0
+            elbow_shoulder_sq = 0.0
+            wrist_shoulder_sq = 0.0
+            hand_shoulder_sq = 0.0
+            for k in range(3):
+                mid = (r_shoulder[i, k] + l_shoulder[i, k]) / 2
+                elbow_dev_sq += (r_elbow[i, k] - mid) ** 2
+                wrist_dev_sq += (r_wrist[i, k] - mid) ** 2
+                hand_dev_sq += (r_hand[i, k] - mid) ** 2
+                elbow_shoulder_sq += (r_elbow[i, k] - r_shoulder[i, k]) ** 2
+                wrist_shoulder_sq += (r_wrist[i, k] - r_shoulder[i, k]) ** 2
+                hand_shoulder_sq += (r_hand[i, k] - r_shoulder[i, k]) ** 2
+            elbow_dev_view[i] = <floating>sqrt(elbow_dev_sq)
+            wrist_dev_view[i] = <floating>sqrt(wrist_dev_sq)
+            hand_dev_view[i] = <floating>sqrt(hand_dev_sq)
+            elbow_shoulder_view[i] = <floating>sqrt(elbow_shoulder_sq)
+            wrist_shoulder_view[i] = <floating>sqrt(wrist_shoulder_sq)
+            hand_shoulder_view[i] = <floating>sqrt(hand_shoulder_sq)
+
+    return elbow_dev, wrist_dev, hand_dev, elbow_shoulder_dist, wrist_shoulder_dist, hand_shoulder_dist
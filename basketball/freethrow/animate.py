@@ -1,10 +1,26 @@
-import json
-
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.animation import FFMpegWriter, FuncAnimation
+from matplotlib.backend_bases import FigureCanvasBase
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from mpl_toolkits.mplot3d import Axes3D
-from mpl_toolkits.mplot3d.art3d import Line3D
+from mpl_toolkits.mplot3d.art3d import Line3D, Line3DCollection
+
+from trial_io import load_trial_joints
+
+try:
+    import imageio.v2 as imageio
+    from joblib import Parallel, delayed, effective_n_jobs
+except ModuleNotFoundError:
+    Parallel = None
+
+# x264 settings shared by both ways of writing the video
+_VIDEO_CODEC = "libx264"
+_VIDEO_PARAMS = ["-preset", "ultrafast", "-crf", "23"]
+
+# Frames rendered per worker task when animate_trial is called with render_parallel=True. Each raw
+# 800x800 RGB frame is about 1.9 MB, so a batch is about 60 MB.
+_RENDER_BATCH_SIZE = 32
 
 # Default connections between joints. Change these as you please
 connections = [
@@ -48,61 +64,59 @@ connections = [
 ]
 
 
-def animate_trial(
-    path_to_json: str,
-    connections: list[tuple[str, str]] = connections,
-    xbuffer=4.0,
-    ybuffer=4.0,
-    zlim=8.0,
-    elev=15.0,
-    azim=40.0,
-    player_color="purple",
-    player_lw=2,
-    ball_color="#ee6730",
-    ball_size=20.0,
-    show_court=True,
-    notebook_mode=True,
-):
+class _RawFrameWriter(FFMpegWriter):
     """
-    Function to animate a single trial of 3D pose data.
+    FFMpegWriter that pipes the canvas pixels that were just drawn for the frame straight to ffmpeg.
 
-    Parameters:
-    -----------
-    - path_to_json: str
-        The path to the JSON file containing the 3D pose data.
-    - connections: list of tuples
-        A list of tuples, where each tuple contains two strings representing the joints to connect.
-    - xbuffer: float
-        The buffer to add to the x-axis limits.
-    - ybuffer: float
-        The buffer to add to the y-axis limits.
-    - zlim: float
-        The limit for the z-axis height.
-    - elev: float
-        The elevation angle for the 3D plot.
-    - azim: float
-        The azimuth angle for the 3D plot.
-    - player_color: str
-        The color to use for the player lines.
-    - player_lw: float
-        The line width to use for the player lines.
-    - ball_color: str
-        The color to use for the ball.
-    - ball_size: float
-        The size to use for the ball.
-    - show_court: bool
-        Whether to show the basketball court in the background.
-    - notebook_mode: bool
-        Whether function is used within a Jupyter notebook.
+    FFMpegWriter.grab_frame calls savefig, which renders the whole figure a second time after the
+    animation has already drawn it. On an Agg canvas that redraws immediately, the RGBA buffer already
+    holds the frame, so it is written as is. Other canvases use the regular grab_frame.
+    """
 
-    Returns:
-    --------
-    - anim: matplotlib.animation.FuncAnimation
-        The animation object created by the function.
+    def grab_frame(self, **savefig_kwargs):
+        canvas = self.fig.canvas
+        if (
+            isinstance(canvas, FigureCanvasAgg)
+            and type(canvas).draw_idle is FigureCanvasBase.draw_idle
+            and self.frame_format == "rgba"
+            and self.dpi == self.fig.dpi
+            and canvas.get_width_height(physical=True) == self.frame_size
+        ):
+            self._proc.stdin.write(canvas.buffer_rgba())
+        else:
+            super().grab_frame(**savefig_kwargs)
+
+
+def _surface_quads(X: np.ndarray, Y: np.ndarray, Z: np.ndarray) -> np.ndarray:
+    """
+    Return the (N_quads, 4, 3) vertices of the quadrilaterals that make up a surface on a meshgrid.
     """
+    grid = np.stack([X, Y, Z], axis=-1)
+    quads = np.stack([grid[:-1, :-1], grid[:-1, 1:], grid[1:, 1:], grid[1:, :-1]], axis=2)
+    return quads.reshape(-1, 4, 3)
 
-    if notebook_mode:
-        plt.rcParams["animation.html"] = "jshtml"
+
+def _build_trial_figure(
+    path_to_json: str,
+    connections: list[tuple[str, str]],
+    xbuffer: float,
+    ybuffer: float,
+    zlim: float,
+    elev: float,
+    azim: float,
+    player_color: str,
+    player_lw: float,
+    ball_color: str,
+    ball_size: float,
+    show_court: bool,
+    blit: bool,
+):
+    """
+    Set up the figure for a trial animation. See animate_trial for the parameters.
+
+    Returns the figure, the update function that draws a given frame, the init function for
+    FuncAnimation, and the number of frames in the trial.
+    """
 
     if show_court:
         try:
@@ -111,28 +125,26 @@ def animate_trial(
             print("mplbasketball not installed. Cannot show court.")
             show_court = False
 
-    with open(path_to_json, "r") as f:
-        data = json.load(f)
+    # Only the joints drawn by the connections, the hips used to center the view, and the joints used
+    # for the deviation lines are extracted. Each entry of player_joint_dict is a (N_frames, 3) array.
+    required_joints = [joint for connection in connections for joint in connection]
+    required_joints += ["R_HIP", "L_HIP", "R_SHOULDER", "L_SHOULDER", "R_ELBOW", "R_WRIST"]
+    required_joints += ["R_1STFINGER", "R_5THFINGER"]
+    trial = load_trial_joints(path_to_json, required_joints)
 
-    player_joint_dict = {}
-    ball_data_array = []
+    player_joint_dict = trial["joints"]
+    ball_data_array = trial["ball"]
 
-    N_frames = len(data["tracking"])
+    # Stack the joints into one contiguous (N_joints, N_frames, 3) array. joint_idx maps a joint name to its row.
+    joint_names = list(player_joint_dict)
+    joint_idx = {joint: i for i, joint in enumerate(joint_names)}
+    player_joints = np.stack([player_joint_dict[joint] for joint in joint_names], axis=0)
 
-    # The block of code below returns a dictionary, where each key is a 3D time series for coordinates of a joint.
-    # Note that it is a list of N_frames elements, each of which is a 3-element list.
-    # If you want to use numpy, you will have to cast it into a numpy array.
-    for frame_data in data["tracking"]:
-        for joint in frame_data["data"]["player"]:
-            if joint not in player_joint_dict:
-                player_joint_dict[joint] = []
-            player_joint_dict[joint].append(frame_data["data"]["player"][joint])
-        ball_data_array.append(frame_data["data"]["ball"])
+    # Midpoint of the right and left hip in the xy plane for every frame, used for the view limits and to
+    # position the sagittal and coronal planes.
+    mh_all = (player_joints[joint_idx["R_HIP"], :, :2] + player_joints[joint_idx["L_HIP"], :, :2]) / 2
 
-    # For convenience, we will cast everything to numpy arrays here, but you can keep them as lists if you prefer.
-    for joint in player_joint_dict:
-        player_joint_dict[joint] = np.array(player_joint_dict[joint])
-    ball_data_array = np.array(ball_data_array)
+    N_frames = len(trial["frame"])
 
     # Animate the data
     fig = plt.figure(figsize=(8, 8))
@@ -147,54 +159,58 @@ def animate_trial(
     ax.set_zticks([])
     ax.view_init(elev=elev, azim=azim)
 
-    # Prepare the lines to be updated
-    lines: dict[tuple[str, str], Line3D] = {
-        connection: ax.plot([], [], [], c=player_color, lw=player_lw)[0] for connection in connections
-    }
+    # All connections are drawn by a single collection. connection_idx holds the rows of player_joints for the
+    # two ends of each connection, so player_joints[connection_idx, frame] gives the (N_connections, 2, 3) segments.
+    connection_idx = np.array(
+        [[joint_idx[part1], joint_idx[part2]] for part1, part2 in connections], dtype=np.intp
+    ).reshape(-1, 2)
+    skeleton = Line3DCollection(
+        player_joints[connection_idx, 0], colors=player_color, linewidths=player_lw, capstyle="projecting"
+    )
+    ax.add_collection3d(skeleton)
 
     ball: Line3D
     (ball,) = ax.plot([], [], [], "o", markersize=ball_size, c=ball_color)
 
-    elbow_dev_line: Line3D
-    (elbow_dev_line,) = ax.plot([], [], [], c="red", lw=1)
-
-    wrist_dev_line: Line3D
-    (wrist_dev_line,) = ax.plot([], [], [], c="green", lw=1)
-
-    hand_dev_line: Line3D
-    (hand_dev_line,) = ax.plot([], [], [], c="blue", lw=1)
-
-    # Initialize the planes as None
-    sagittal_plane = [None]  # Use a list to make it mutable in the nested function
-    coronal_plane = [None]
+    # The elbow, wrist and hand deviation lines all start at the shoulder midpoint and are drawn by a single
+    # collection. deviation_segments holds their end points for every frame, with shape (N_frames, 3, 2, 3).
+    shoulder_midpoints = (player_joints[joint_idx["R_SHOULDER"]] + player_joints[joint_idx["L_SHOULDER"]]) / 2
+    r_elbows = player_joints[joint_idx["R_ELBOW"]]
+    r_wrists = player_joints[joint_idx["R_WRIST"]]
+    r_hands = (player_joints[joint_idx["R_1STFINGER"]] + player_joints[joint_idx["R_5THFINGER"]]) / 2
+    deviation_ends = np.stack([r_elbows, r_wrists, r_hands], axis=1)
+    deviation_starts = np.broadcast_to(shoulder_midpoints[:, None], deviation_ends.shape)
+    deviation_segments = np.stack([deviation_starts, deviation_ends], axis=2)
+    deviation_lines = Line3DCollection(deviation_segments[0], colors=["red", "green", "blue"], linewidths=1)
+    ax.add_collection3d(deviation_lines)
+
+    # The sagittal and coronal planes keep their size and only move with the player, so they are drawn once
+    # here around the origin and translated in update() by replacing the vertices of the existing surfaces.
+    Y_sagittal, Z_sagittal = np.meshgrid(np.linspace(-ybuffer, ybuffer, num=10), np.linspace(0, zlim, num=10))
+    X_sagittal = np.zeros_like(Y_sagittal)
+    sagittal_plane = ax.plot_surface(X_sagittal, Y_sagittal, Z_sagittal, color="gray", alpha=0.3, edgecolor="none")
+    sagittal_quads = _surface_quads(X_sagittal, Y_sagittal, Z_sagittal)
+
+    X_coronal, Z_coronal = np.meshgrid(np.linspace(-xbuffer, xbuffer, num=10), np.linspace(0, zlim, num=10))
+    Y_coronal = np.zeros_like(X_coronal)
+    coronal_plane = ax.plot_surface(X_coronal, Y_coronal, Z_coronal, color="blue", alpha=0.3, edgecolor="none")
+    coronal_quads = _surface_quads(X_coronal, Y_coronal, Z_coronal)
+
+    # Per-frame translation of each plane: the sagittal plane sits at x = shoulder midpoint and is centred on
+    # the hips in y, the coronal plane sits at y = shoulder midpoint and is centred on the hips in x. The
+    # translated vertices are written into preallocated buffers so no new arrays are created per frame.
+    sagittal_offsets = np.zeros((N_frames, 3))
+    sagittal_offsets[:, 0] = shoulder_midpoints[:, 0]
+    sagittal_offsets[:, 1] = mh_all[:, 1]
+    coronal_offsets = np.zeros((N_frames, 3))
+    coronal_offsets[:, 0] = mh_all[:, 0]
+    coronal_offsets[:, 1] = shoulder_midpoints[:, 1]
+    sagittal_verts = np.empty_like(sagittal_quads)
+    coronal_verts = np.empty_like(coronal_quads)
 
     def update(frame: int):
-        nonlocal sagittal_plane, coronal_plane
-
-        # Use the average of the right and left hip to center the view.
-        rh_xy = player_joint_dict["R_HIP"][frame][:2]
-        lh_xy = player_joint_dict["L_HIP"][frame][:2]
-        mh_xy = (rh_xy + lh_xy) / 2
-
-        ax.set_xlim([mh_xy[0] - xbuffer, mh_xy[0] + xbuffer])
-        ax.set_ylim([mh_xy[1] - ybuffer, mh_xy[1] + ybuffer])
-
-        # Update the line data for each connection
-        for connection in connections:
-            part1, part2 = connection
-            x = [
-                player_joint_dict[part1][frame, 0],
-                player_joint_dict[part2][frame, 0],
-            ]
-            y = [
-                player_joint_dict[part1][frame, 1],
-                player_joint_dict[part2][frame, 1],
-            ]
-            z = [
-                player_joint_dict[part1][frame, 2],
-                player_joint_dict[part2][frame, 2],
-            ]
-            lines[connection].set_data_3d(x, y, z)
+        # Update the line data for every connection at once
+        skeleton.set_segments(player_joints[connection_idx, frame])
 
         # Update ball data
         x = ball_data_array[frame, 0]
@@ -202,67 +218,25 @@ def animate_trial(
         z = ball_data_array[frame, 2]
         ball.set_data_3d([x], [y], [z])
 
-        # Calculate additional points for analysis
-        r_shoulder = player_joint_dict["R_SHOULDER"][frame]
-        l_shoulder = player_joint_dict["L_SHOULDER"][frame]
-        r_elbow = player_joint_dict["R_ELBOW"][frame]
-        r_wrist = player_joint_dict["R_WRIST"][frame]
-        r_hand = np.mean([player_joint_dict["R_1STFINGER"][frame], player_joint_dict["R_5THFINGER"][frame]], axis=0)
-
-        # Calculate midline (between shoulders)
-        shoulder_midpoint = (r_shoulder + l_shoulder) / 2
-
-        # Define variables for the coordinates to update deviation lines
-        elbow_dev_x = [shoulder_midpoint[0], r_elbow[0]]
-        elbow_dev_y = [shoulder_midpoint[1], r_elbow[1]]
-        elbow_dev_z = [shoulder_midpoint[2], r_elbow[2]]
-
-        wrist_dev_x = [shoulder_midpoint[0], r_wrist[0]]
-        wrist_dev_y = [shoulder_midpoint[1], r_wrist[1]]
-        wrist_dev_z = [shoulder_midpoint[2], r_wrist[2]]
-
-        hand_dev_x = [shoulder_midpoint[0], r_hand[0]]
-        hand_dev_y = [shoulder_midpoint[1], r_hand[1]]
-        hand_dev_z = [shoulder_midpoint[2], r_hand[2]]
-
-        # Update deviation lines
-        elbow_dev_line.set_data_3d(elbow_dev_x, elbow_dev_y, elbow_dev_z)
-        wrist_dev_line.set_data_3d(wrist_dev_x, wrist_dev_y, wrist_dev_z)
-        hand_dev_line.set_data_3d(hand_dev_x, hand_dev_y, hand_dev_z)
-
-        # Remove previous planes if they exist
-        if sagittal_plane[0] is not None:
-            sagittal_plane[0].remove()
-        if coronal_plane[0] is not None:
-            coronal_plane[0].remove()
-
-        # Define the sagittal plane at x = shoulder_midpoint[0]
-        x_plane = shoulder_midpoint[0]
-        y_min = mh_xy[1] - ybuffer
-        y_max = mh_xy[1] + ybuffer
-        z_min = 0
-        z_max = zlim
-        y_plane = np.linspace(y_min, y_max, num=10)
-        z_plane = np.linspace(z_min, z_max, num=10)
-        Y_plane, Z_plane = np.meshgrid(y_plane, z_plane)
-        X_plane = np.full_like(Y_plane, fill_value=x_plane)
-
-        # Plot the sagittal plane
-        sagittal_plane[0] = ax.plot_surface(X_plane, Y_plane, Z_plane, color="gray", alpha=0.3, edgecolor="none")
-
-        # Define the coronal plane at y = shoulder_midpoint[1]
-        y_plane_coronal = shoulder_midpoint[1]
-        x_min = mh_xy[0] - xbuffer
-        x_max = mh_xy[0] + xbuffer
-        x_plane_coronal = np.linspace(x_min, x_max, num=10)
-        z_plane_coronal = np.linspace(z_min, z_max, num=10)
-        X_plane_coronal, Z_plane_coronal = np.meshgrid(x_plane_coronal, z_plane_coronal)
-        Y_plane_coronal = np.full_like(X_plane_coronal, fill_value=y_plane_coronal)
-
-        # Plot the coronal plane
-        coronal_plane[0] = ax.plot_surface(
-            X_plane_coronal, Y_plane_coronal, Z_plane_coronal, color="blue", alpha=0.3, edgecolor="none"
-        )
+        # Update the elbow, wrist and hand deviation lines at once
+        deviation_lines.set_segments(deviation_segments[frame])
+
+        # Move the sagittal and coronal planes with the player
+        np.add(sagittal_quads, sagittal_offsets[frame], out=sagittal_verts)
+        np.add(coronal_quads, coronal_offsets[frame], out=coronal_verts)
+        sagittal_plane.set_verts(sagittal_verts)
+        coronal_plane.set_verts(coronal_verts)
+
+        # When blitting, Axes3D.draw is not called between frames, so the 3D collections have to be projected
+        # here. The projection matrix from the last full draw stays valid because the view never changes.
+        if blit and ax.M is not None:
+            for collection in (skeleton, deviation_lines, sagittal_plane, coronal_plane):
+                collection.do_3d_projection()
+
+        return skeleton, ball, deviation_lines, sagittal_plane, coronal_plane
+
+    def init():
+        return update(0)
 
     if show_court is True:
         ax.grid(False)
@@ -277,11 +251,151 @@ def animate_trial(
         ax.zaxis.line.set_linewidth(0)
         draw_court_3d(ax, origin=np.array([0.0, 0.0]), line_width=2)
 
-    plt.subplots(layout="constrained")
-    plt.close()
+    # The view is fixed to the range of the hip midpoint over the whole trial instead of following it every
+    # frame. Changing the axis limits would invalidate the blitting background.
+    ax.set_xlim([np.nanmin(mh_all[:, 0]) - xbuffer, np.nanmax(mh_all[:, 0]) + xbuffer])
+    ax.set_ylim([np.nanmin(mh_all[:, 1]) - ybuffer, np.nanmax(mh_all[:, 1]) + ybuffer])
+
+    return fig, update, init, N_frames
+
+
+def _render_frames(path_to_json: str, frames: list[int], figure_kwargs: dict) -> list[np.ndarray]:
+    """
+    Render the given frames of a trial to (height, width, 3) RGB arrays. Runs in the worker processes used
+    by animate_trial when render_parallel is True, each of which builds its own copy of the figure.
+    """
+    fig, update, _, _ = _build_trial_figure(path_to_json, blit=False, **figure_kwargs)
+    # Render off-screen with Agg, whatever backend is active in this process
+    canvas = FigureCanvasAgg(fig)
+
+    images = []
+    for frame in frames:
+        update(frame)
+        canvas.draw()
+        images.append(np.asarray(canvas.buffer_rgba())[..., :3].copy())
 
-    anim = FuncAnimation(fig, update, frames=N_frames, interval=1000 / 30)
-    write = FFMpegWriter(fps=60)
+    plt.close(fig)
+    return images
 
+
+def animate_trial(
+    path_to_json: str,
+    connections: list[tuple[str, str]] = connections,
+    xbuffer=4.0,
+    ybuffer=4.0,
+    zlim=8.0,
+    elev=15.0,
+    azim=40.0,
+    player_color="purple",
+    player_lw=2,
+    ball_color="#ee6730",
+    ball_size=20.0,
+    show_court=True,
+    notebook_mode=True,
+    blit=True,
+    render_parallel=False,
+    n_jobs=-1,
+):
+    """
+    Function to animate a single trial of 3D pose data.
+
+    Parameters:
+    -----------
+    - path_to_json: str
+        The path to the JSON file containing the 3D pose data.
+    - connections: list of tuples
+        A list of tuples, where each tuple contains two strings representing the joints to connect.
+    - xbuffer: float
+        The buffer to add to the x-axis limits.
+    - ybuffer: float
+        The buffer to add to the y-axis limits.
+    - zlim: float
+        The limit for the z-axis height.
+    - elev: float
+        The elevation angle for the 3D plot.
+    - azim: float
+        The azimuth angle for the 3D plot.
+    - player_color: str
+        The color to use for the player lines.
+    - player_lw: float
+        The line width to use for the player lines.
+    - ball_color: str
+        The color to use for the ball.
+    - ball_size: float
+        The size to use for the ball.
+    - show_court: bool
+        Whether to show the basketball court in the background.
+    - notebook_mode: bool
+        Whether function is used within a Jupyter notebook.
+    - blit: bool
+        Whether to use blitting when the animation is played in an interactive window. Only the moving
+        artists are redrawn each frame, on top of a cached background of the court and axes.
+    - render_parallel: bool
+        Whether to render the frames of the saved video in parallel worker processes. Requires joblib and
+        imageio (with imageio-ffmpeg). Frames are rendered in batches of 32, and at most one batch per worker
+        (about 60 MB each) is held in memory at a time, whatever the length of the trial.
+    - n_jobs: int
+        The number of worker processes used when render_parallel is True. -1 uses all CPUs.
+
+    Returns:
+    --------
+    - anim: matplotlib.animation.FuncAnimation or None
+        The animation object created by the function. None when render_parallel is True, as the frames are
+        then rendered in the worker processes only.
+    """
+
+    if notebook_mode:
+        plt.rcParams["animation.html"] = "jshtml"
+
+    figure_kwargs = dict(
+        connections=connections,
+        xbuffer=xbuffer,
+        ybuffer=ybuffer,
+        zlim=zlim,
+        elev=elev,
+        azim=azim,
+        player_color=player_color,
+        player_lw=player_lw,
+        ball_color=ball_color,
+        ball_size=ball_size,
+        show_court=show_court,
+    )
+    if render_parallel and Parallel is None:
+        print("joblib or imageio not installed. Rendering frames sequentially.")
+        render_parallel = False
+
+    if render_parallel:
+        # The workers build their own figures, so the parent only needs the number of frames
+        N_frames = len(load_trial_joints(path_to_json, joints=())["frame"])
+        # Frames are rendered in batches of _RENDER_BATCH_SIZE, one round of n_workers batches at a time, and
+        # each round is written before the next is dispatched. At most n_workers * _RENDER_BATCH_SIZE raw
+        # frames are held in the parent, whatever the length of the trial.
+        n_workers = effective_n_jobs(n_jobs)
+        batch_starts = range(0, N_frames, _RENDER_BATCH_SIZE)
+        batches = [list(range(i, min(i + _RENDER_BATCH_SIZE, N_frames))) for i in batch_starts]
+        with imageio.get_writer(
+            "SaggitalAndCoronalPlanes.mp4",
+            fps=60,
+            codec=_VIDEO_CODEC,
+            quality=None,
+            pixelformat="yuv420p",
+            ffmpeg_params=_VIDEO_PARAMS,
+        ) as writer, Parallel(n_jobs=n_workers, return_as="generator") as parallel:
+            for start in range(0, len(batches), n_workers):
+                results = parallel(
+                    delayed(_render_frames)(path_to_json, batch, figure_kwargs)
+                    for batch in batches[start : start + n_workers]
+                )
+                for images in results:
+                    for image in images:
+                        writer.append_data(image)
+        return None
+
+    fig, update, init, N_frames = _build_trial_figure(path_to_json, blit=blit, **figure_kwargs)
+
+    anim = FuncAnimation(fig, update, frames=N_frames, init_func=init, interval=1000 / 30, blit=blit)
+
+    write = _RawFrameWriter(fps=60, codec=_VIDEO_CODEC, extra_args=_VIDEO_PARAMS + ["-pix_fmt", "yuv420p"])
     anim.save("SaggitalAndCoronalPlanes.mp4", writer=write)
+
     return anim
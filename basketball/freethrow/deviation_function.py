@@ -1,26 +1,134 @@
-import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property, partial
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
+from trial_io import extract_trial_arrays, load_trial_joints, load_trial_json, stream_trial_joints
+
+try:
+    from _devkernel import compute_devs as _compute_devs_compiled
+except ModuleNotFoundError:
+    _compute_devs_compiled = None
+
+try:
+    from numba import njit
+except ModuleNotFoundError:
+    njit = None
+
+# Joints read by FreeThrowAnalyzer.analyze_trial
+ANALYZER_JOINTS = ("R_SHOULDER", "L_SHOULDER", "R_ELBOW", "R_WRIST", "R_1STFINGER", "R_5THFINGER")
+
+# Columns of FreeThrowAnalyzer.analyze_all_trials
+TRIALS_SUMMARY_DTYPE = np.dtype(
+    [("trial_number", np.int64), ("trial_id", object), ("result", object)]
+    + [(f"{agg}_{limb}_deviation", np.float64) for agg in ("max", "avg", "std") for limb in ("elbow", "wrist", "hand")]
+)
+
+
+def _compute_devs_numpy(
+    r_shoulder: np.ndarray, l_shoulder: np.ndarray, r_elbow: np.ndarray, r_wrist: np.ndarray, r_hand: np.ndarray
+):
+    shoulder_midpoint = (r_shoulder + l_shoulder) / 2
+    return (
+        np.linalg.norm(r_elbow - shoulder_midpoint, axis=1),
+        np.linalg.norm(r_wrist - shoulder_midpoint, axis=1),
+        np.linalg.norm(r_hand - shoulder_midpoint, axis=1),
+        np.linalg.norm(r_elbow - r_shoulder, axis=1),
+        np.linalg.norm(r_wrist - r_shoulder, axis=1),
+        np.linalg.norm(r_hand - r_shoulder, axis=1),
+    )
+
+
+if njit is not None:
+    # Every fastmath flag except nnan/ninf, so NaN coordinates still propagate into the distances. A trial is
+    # only a few hundred frames, so the loop runs serially; threads would cost more than they save.
+    @njit(fastmath={"nsz", "arcp", "contract", "afn", "reassoc"}, cache=True)
+    def compute_devs(r_shoulder, l_shoulder, r_elbow, r_wrist, r_hand):
+        """
+        Fused version of _compute_devs_numpy: a single pass over the frames with no (N_frames, 3) temporaries.
+        """
+        N_frames = r_shoulder.shape[0]
+        elbow_dev = np.empty(N_frames, dtype=r_shoulder.dtype)
+        wrist_dev = np.empty(N_frames, dtype=r_shoulder.dtype)
+        hand_dev = np.empty(N_frames, dtype=r_shoulder.dtype)
+        elbow_shoulder_dist = np.empty(N_frames, dtype=r_shoulder.dtype)
+        wrist_shoulder_dist = np.empty(N_frames, dtype=r_shoulder.dtype)
+        hand_shoulder_dist = np.empty(N_frames, dtype=r_shoulder.dtype)
+
+        for i in range(N_frames):
+            elbow_dev_sq = 0.0
+            wrist_dev_sq = 0.0
+            hand_dev_sq = 0.0
+            elbow_shoulder_sq = 0.0
+            wrist_shoulder_sq = 0.0
+            hand_shoulder_sq = 0.0
+            for k in range(3):
+                mid = (r_shoulder[i, k] + l_shoulder[i, k]) / 2
+                elbow_dev_sq += (r_elbow[i, k] - mid) ** 2
+                wrist_dev_sq += (r_wrist[i, k] - mid) ** 2
+                hand_dev_sq += (r_hand[i, k] - mid) ** 2
+                elbow_shoulder_sq += (r_elbow[i, k] - r_shoulder[i, k]) ** 2
+                wrist_shoulder_sq += (r_wrist[i, k] - r_shoulder[i, k]) ** 2
+                hand_shoulder_sq += (r_hand[i, k] - r_shoulder[i, k]) ** 2
+            elbow_dev[i] = np.sqrt(elbow_dev_sq)
+            wrist_dev[i] = np.sqrt(wrist_dev_sq)
+            hand_dev[i] = np.sqrt(hand_dev_sq)
+            elbow_shoulder_dist[i] = np.sqrt(elbow_shoulder_sq)
+            wrist_shoulder_dist[i] = np.sqrt(wrist_shoulder_sq)
+            hand_shoulder_dist[i] = np.sqrt(hand_shoulder_sq)
+
+        return elbow_dev, wrist_dev, hand_dev, elbow_shoulder_dist, wrist_shoulder_dist, hand_shoulder_dist
+
+else:
+    compute_devs = _compute_devs_numpy
+
+# The compiled Cython kernel (_devkernel.pyx), when built, needs no JIT warmup and is preferred over Numba
+if _compute_devs_compiled is not None:
+    compute_devs = _compute_devs_compiled
+
+
+def _load_trial(trial_file: Path, joints: Optional[Iterable[str]] = None) -> Dict:
+    if joints is None:
+        return load_trial_json(trial_file)
+    return load_trial_joints(trial_file, joints)
+
 
 class FreeThrowDataLoader:
     def __init__(self, base_path: str):
         self.base_path = Path(base_path)
 
-    def load_participant_data(self, participant_id: str) -> List[Dict]:
+    def load_participant_data(
+        self, participant_id: str, joints: Optional[Iterable[str]] = None, max_workers: Optional[int] = 1
+    ) -> List[Dict]:
+        # When joints is given, only those joints are extracted from each trial (see trial_io.load_trial_joints)
         participant_path = self.base_path / participant_id
-        trials = []
+        trial_files = sorted(participant_path.glob("BB_FT_*.json"))
+        load_trial = partial(_load_trial, joints=None if joints is None else tuple(joints))
 
-        for trial_file in sorted(participant_path.glob("BB_FT_*.json")):
-            with open(trial_file, "r") as f:
-                trial_data = json.load(f)
-                trials.append(trial_data)
+        # With joints given and max_workers > 1 (None for all CPUs), the files are parsed in worker processes
+        # and map keeps them in file order. Full trials are left in-process, since pickling the nested dicts
+        # back costs about as much as parsing them. Workers are spawned rather than forked so they never
+        # inherit threads already running in this process; scripts need an `if __name__ == "__main__":` guard.
+        n_workers = min(max_workers or os.cpu_count() or 1, len(trial_files))
+        if joints is None or n_workers <= 1:
+            return [load_trial(trial_file) for trial_file in trial_files]
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(load_trial, trial_files, chunksize=max(1, len(trial_files) // (4 * n_workers))))
+
+    def load_participant_streaming(
+        self, participant_id: str, joints: Optional[Iterable[str]] = ANALYZER_JOINTS
+    ) -> Iterator[Dict]:
+        # Yields one trial at a time, each parsed frame by frame (see trial_io.stream_trial_joints)
+        participant_path = self.base_path / participant_id
 
-        return trials
+        for trial_file in sorted(participant_path.glob("BB_FT_*.json")):
+            yield stream_trial_joints(trial_file, joints)
 
 
 class FreeThrowAnalyzer:
@@ -28,80 +136,99 @@ class FreeThrowAnalyzer:
         self.trials_data = trials_data
         self.participant_id = trials_data[0]["participant_id"]
 
+    @property
+    def trials_data(self) -> List[Dict]:
+        return self._trials_data
+
+    @trials_data.setter
+    def trials_data(self, trials_data: List[Dict]):
+        # Assigning new trials drops the cached trials_df so it is recomputed on next access
+        self._trials_data = trials_data
+        self.__dict__.pop("trials_df", None)
+
     def _calculate_midpoint(self, p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
         return (p1 + p2) / 2
 
+    def _compute_distances(self, trial_data: Dict) -> Dict[str, np.ndarray]:
+        # Trials loaded with joints=ANALYZER_JOINTS already hold the coordinate arrays
+        if "joints" not in trial_data:
+            trial_data = extract_trial_arrays(trial_data, ANALYZER_JOINTS)
+        joints = trial_data["joints"]
+
+        # Each joint is a (N_frames, 3) array, so every distance is computed for all frames at once
+        r_hand = self._calculate_midpoint(joints["R_1STFINGER"], joints["R_5THFINGER"])
+        (
+            elbow_dev,
+            wrist_dev,
+            hand_dev,
+            elbow_shoulder_dist,
+            wrist_shoulder_dist,
+            hand_shoulder_dist,
+        ) = compute_devs(joints["R_SHOULDER"], joints["L_SHOULDER"], joints["R_ELBOW"], joints["R_WRIST"], r_hand)
+
+        return {
+            "frame": trial_data["frame"],
+            "time": trial_data["time"],
+            "elbow_deviation": elbow_dev,
+            "wrist_deviation": wrist_dev,
+            "hand_deviation": hand_dev,
+            "elbow_shoulder_dist": elbow_shoulder_dist,
+            "wrist_shoulder_dist": wrist_shoulder_dist,
+            "hand_shoulder_dist": hand_shoulder_dist,
+        }
+
     def analyze_trial(self, trial_data: Dict) -> Dict[str, Any]:
-        frames_analysis = []
-
-        for frame in trial_data["tracking"]:
-            player = frame["data"]["player"]
-
-            r_shoulder = np.array(player["R_SHOULDER"])
-            l_shoulder = np.array(player["L_SHOULDER"])
-            r_elbow = np.array(player["R_ELBOW"])
-            r_wrist = np.array(player["R_WRIST"])
-            r_hand = np.mean([np.array(player["R_1STFINGER"]), np.array(player["R_5THFINGER"])], axis=0)
-
-            shoulder_midpoint = self._calculate_midpoint(r_shoulder, l_shoulder)
-
-            elbow_dev = np.linalg.norm(r_elbow - shoulder_midpoint)
-            wrist_dev = np.linalg.norm(r_wrist - shoulder_midpoint)
-            hand_dev = np.linalg.norm(r_hand - shoulder_midpoint)
-
-            elbow_shoulder_dist = np.linalg.norm(r_elbow - r_shoulder)
-            wrist_shoulder_dist = np.linalg.norm(r_wrist - r_shoulder)
-            hand_shoulder_dist = np.linalg.norm(r_hand - r_shoulder)
-
-            frames_analysis.append(
-                {
-                    "frame": frame["frame"],
-                    "time": frame["time"],
-                    "elbow_deviation": elbow_dev,
-                    "wrist_deviation": wrist_dev,
-                    "hand_deviation": hand_dev,
-                    "elbow_shoulder_dist": elbow_shoulder_dist,
-                    "wrist_shoulder_dist": wrist_shoulder_dist,
-                    "hand_shoulder_dist": hand_shoulder_dist,
-                }
-            )
+        frames_analysis = pd.DataFrame(self._compute_distances(trial_data))
 
         return {"trial_id": trial_data["trial_id"], "result": trial_data["result"], "frames_analysis": frames_analysis}
 
+    def analyze_trial_stream(self, path: Union[str, Path]) -> Dict[str, Any]:
+        # Reads only the analyzer joints from the trial file without loading the whole document
+        return self.analyze_trial(stream_trial_joints(path, ANALYZER_JOINTS))
+
     def analyze_all_trials(self) -> pd.DataFrame:
-        trials_summary = []
-
-        for trial_idx, trial in enumerate(self.trials_data, 1):
-            analysis = self.analyze_trial(trial)
-            frames_df = pd.DataFrame(analysis["frames_analysis"])
-
-            trials_summary.append(
-                {
-                    "trial_number": trial_idx,
-                    "trial_id": trial["trial_id"],
-                    "result": analysis["result"],
-                    "max_elbow_deviation": frames_df["elbow_deviation"].max(),
-                    "max_wrist_deviation": frames_df["wrist_deviation"].max(),
-                    "max_hand_deviation": frames_df["hand_deviation"].max(),
-                    "avg_elbow_deviation": frames_df["elbow_deviation"].mean(),
-                    "avg_wrist_deviation": frames_df["wrist_deviation"].mean(),
-                    "avg_hand_deviation": frames_df["hand_deviation"].mean(),
-                    "std_elbow_deviation": frames_df["elbow_deviation"].std(),
-                    "std_wrist_deviation": frames_df["wrist_deviation"].std(),
-                    "std_hand_deviation": frames_df["hand_deviation"].std(),
-                }
+        # The summary is filled into a preallocated structured array and converted to a DataFrame once.
+        # Strings are kept as Python objects so that trial ids and results are never truncated.
+        trials_summary = np.empty(len(self.trials_data), dtype=TRIALS_SUMMARY_DTYPE)
+
+        for i, trial in enumerate(self.trials_data):
+            distances = self._compute_distances(trial)
+            # Per-frame distances are float32, the summary statistics are computed in float64. The nan*
+            # reductions (with ddof=1 for the standard deviation) match what pandas computed previously.
+            elbow_dev = distances["elbow_deviation"].astype(np.float64)
+            wrist_dev = distances["wrist_deviation"].astype(np.float64)
+            hand_dev = distances["hand_deviation"].astype(np.float64)
+
+            trials_summary[i] = (
+                i + 1,
+                trial["trial_id"],
+                trial["result"],
+                np.nanmax(elbow_dev),
+                np.nanmax(wrist_dev),
+                np.nanmax(hand_dev),
+                np.nanmean(elbow_dev),
+                np.nanmean(wrist_dev),
+                np.nanmean(hand_dev),
+                np.nanstd(elbow_dev, ddof=1),
+                np.nanstd(wrist_dev, ddof=1),
+                np.nanstd(hand_dev, ddof=1),
             )
 
         return pd.DataFrame(trials_summary)
 
+    @cached_property
+    def trials_df(self) -> pd.DataFrame:
+        # Result of analyze_all_trials, computed once and reset whenever trials_data is assigned
+        return self.analyze_all_trials()
+
     def check_results_distribution(self):
-        trials_df = self.analyze_all_trials()
+        trials_df = self.trials_df
         result_counts = trials_df["result"].value_counts()
         print("Distribution of Results (Make vs. Miss):")
         print(result_counts)
 
     def plot_deviation_spread(self):
-        trials_df = self.analyze_all_trials()
+        trials_df = self.trials_df
 
         # Separate makes and misses
         makes = trials_df[trials_df["result"] == "made"]
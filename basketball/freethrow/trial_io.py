@@ -0,0 +1,268 @@
+import json
+import math
+import re
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import numpy as np
+
+try:
+    import simdjson
+except ModuleNotFoundError:
+    simdjson = None
+
+try:
+    import ijson
+except ModuleNotFoundError:
+    ijson = None
+
+
+# A NaN token followed by ",", "]" or "}". _nan_to_null also checks that it follows "[", "," or ":", so
+# NaN inside object keys and string values such as "NaN_retake" is left alone.
+_NAN_TOKEN = re.compile(rb"NaN(?=\s*[,\]}])")
+
+
+def _nan_to_null(raw: bytes) -> bytes:
+    # simdjson and ijson reject the bare NaN tokens used for untracked positions, so they are parsed as null.
+    # The left context is checked in Python since a regex starting with the optional whitespace is far slower.
+    def replace(match):
+        i = match.start() - 1
+        while i >= 0 and raw[i] in b" \t\r\n":
+            i -= 1
+        return b"null" if i >= 0 and raw[i] in b"[,:" else b"NaN"
+
+    return _NAN_TOKEN.sub(replace, raw)
+
+
+def _restore_nested(value):
+    # None inside a nested metadata value can only be a rewritten NaN; returns False for a rewritten string
+    items = value.items() if isinstance(value, dict) else enumerate(value)
+    for key, item in items:
+        if item is None:
+            value[key] = math.nan
+        elif isinstance(item, str) and "null" in item:
+            return False
+        elif isinstance(item, (dict, list)) and not _restore_nested(item):
+            return False
+    return True
+
+
+def _restore_metadata(metadata: Dict) -> Optional[Dict]:
+    """
+    Turn the null metadata values of a file that had NaN rewritten to null back into NaN, in scalar values
+    and inside nested lists and dicts. Only valid for files without real nulls. Returns None when a string
+    value contains "null", which can only come from a NaN rewritten inside a string, so the caller can
+    parse the file with json instead.
+    """
+    metadata = dict(metadata)
+    if not _restore_nested(metadata):
+        return None
+    return metadata
+
+
+class _NanToNullReader:
+    """
+    Binary file wrapper that rewrites value-position NaN tokens to null as the file is read, for streaming
+    parsers that reject NaN. Each read returns the data up to and including the last comma seen, and
+    that comma is kept as the left context of the next read, so _nan_to_null always sees a whole token
+    together with the characters around it. has_null records whether the file itself contained null.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._context = b""
+        self._pending = b""
+        self.has_null = False
+
+    def read(self, size: int = -1) -> bytes:
+        while True:
+            chunk = self._f.read(size)
+            self.has_null = self.has_null or b"null" in self._pending[-3:] + chunk
+            data = self._context + self._pending + chunk
+            if not chunk:
+                context_size = len(self._context)
+                self._context, self._pending = b"", b""
+                return _nan_to_null(data)[context_size:]
+
+            cut = data.rfind(b",") + 1
+            if cut > len(self._context):
+                context_size = len(self._context)
+                self._context, self._pending = data[cut - 1 : cut], data[cut:]
+                return _nan_to_null(data[:cut])[context_size:]
+            self._pending += chunk
+
+
+def load_trial_json(path: Union[str, Path]) -> Dict:
+    """
+    Load a single BB_FT_*.json trial file into plain Python dicts and lists.
+
+    The standard library json module is used here because it reads the bare NaN tokens of the trial files
+    as they are. The faster parsers reject NaN, and restoring it throughout the full document costs more
+    than they save; load_trial_joints uses them for the lazy, joint-subset path.
+    """
+    with open(path, "rb") as f:
+        return json.load(f)
+
+
+def extract_trial_arrays(trial_data: Dict, joints: Optional[Iterable[str]] = None, dtype=np.float32) -> Dict:
+    """
+    Convert an already parsed trial into per-joint (N_frames, 3) arrays.
+
+    Returns the trial metadata together with "frame", "time", "ball" and "joints" entries, where
+    "joints" maps each requested joint name to its coordinate time series. All joints, as named in
+    the first frame, are extracted when joints is None. Coordinates are stored as float32 by default,
+    which is well within the millimetre precision of the tracking data.
+    """
+    tracking = trial_data["tracking"]
+    if joints is None:
+        joints = list(tracking[0]["data"]["player"]) if tracking else []
+
+    arrays = {key: value for key, value in trial_data.items() if key != "tracking"}
+    arrays["frame"] = np.array([frame["frame"] for frame in tracking])
+    arrays["time"] = np.array([frame["time"] for frame in tracking])
+    arrays["ball"] = np.array([frame["data"]["ball"] for frame in tracking], dtype=dtype).reshape(-1, 3)
+    arrays["joints"] = {
+        joint: np.array([frame["data"]["player"][joint] for frame in tracking], dtype=dtype).reshape(-1, 3)
+        for joint in joints
+    }
+    return arrays
+
+
+def load_trial_joints(path: Union[str, Path], joints: Optional[Iterable[str]] = None, dtype=np.float32) -> Dict:
+    """
+    Load only the requested joints of a trial, in the same layout as extract_trial_arrays.
+
+    With pysimdjson installed the document is walked lazily and every other joint is skipped
+    without being converted to Python objects.
+    """
+    if joints is not None:
+        joints = list(dict.fromkeys(joints))
+
+    if simdjson is None:
+        return extract_trial_arrays(load_trial_json(path), joints, dtype)
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    # Files with real nulls would have them turned into NaN below, so they are parsed with json instead
+    if b"null" in raw:
+        return extract_trial_arrays(json.loads(raw), joints, dtype)
+    doc = simdjson.Parser().parse(_nan_to_null(raw))
+
+    tracking = doc["tracking"]
+    N_frames = len(tracking)
+    if joints is None:
+        joints = list(tracking[0]["data"]["player"].keys()) if N_frames else []
+
+    # Nested metadata values are converted from parser-bound proxies to plain lists and dicts
+    metadata = {}
+    for key in doc.keys():
+        if key != "tracking":
+            value = doc[key]
+            if isinstance(value, simdjson.Array):
+                value = value.as_list()
+            elif isinstance(value, simdjson.Object):
+                value = value.as_dict()
+            metadata[key] = value
+    arrays = _restore_metadata(metadata)
+    if arrays is None:
+        return extract_trial_arrays(json.loads(raw), joints, dtype)
+    frame_ids = np.empty(N_frames, dtype=np.int64)
+    times = np.empty(N_frames, dtype=np.int64)
+    ball = np.empty((N_frames, 3), dtype=dtype)
+    joint_arrays = {joint: np.empty((N_frames, 3), dtype=dtype) for joint in joints}
+
+    # Assigning a list containing None into a float array stores NaN, so no extra restore step is needed.
+    for i, frame in enumerate(tracking):
+        frame_ids[i] = frame["frame"]
+        times[i] = frame["time"]
+        data = frame["data"]
+        ball[i] = data["ball"].as_list()
+        player = data["player"]
+        for joint, joint_array in joint_arrays.items():
+            joint_array[i] = player[joint].as_list()
+
+    arrays["frame"] = frame_ids
+    arrays["time"] = times
+    arrays["ball"] = ball
+    arrays["joints"] = joint_arrays
+    return arrays
+
+
+def _grow(array: np.ndarray, capacity: int) -> np.ndarray:
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+def stream_trial_joints(path: Union[str, Path], joints: Optional[Iterable[str]] = None, dtype=np.float32) -> Dict:
+    """
+    Load the requested joints of a trial in the same layout as load_trial_joints, parsing the tracking
+    frames one at a time with ijson so that the whole JSON document is never held in memory.
+
+    Falls back to load_trial_joints when ijson is not installed.
+    """
+    if ijson is None:
+        return load_trial_joints(path, joints, dtype)
+
+    if joints is not None:
+        joints = list(dict.fromkeys(joints))
+
+    # The trial metadata comes before "tracking" in the trial files, so only the start of the file is parsed
+    arrays = {}
+    with open(path, "rb") as f:
+        reader = _NanToNullReader(f)
+        builder = builder_key = None
+        for prefix, event, value in ijson.parse(reader, use_float=True):
+            if builder is not None:
+                # Nested metadata values are built up until the list or dict that started them ends
+                builder.event(event, value)
+                if prefix == builder_key and event in ("end_map", "end_array"):
+                    arrays[builder_key] = builder.value
+                    builder = None
+            elif prefix == "" and event == "map_key" and value == "tracking":
+                break
+            elif prefix and "." not in prefix:
+                if event in ("start_map", "start_array"):
+                    builder, builder_key = ijson.ObjectBuilder(), prefix
+                    builder.event(event, value)
+                else:
+                    arrays[prefix] = value
+        # Real nulls or a NaN rewritten inside a string would make the metadata differ from json.load
+        arrays = None if reader.has_null else _restore_metadata(arrays)
+    if arrays is None:
+        return load_trial_joints(path, joints, dtype)
+
+    # Frames are written into arrays that start with room for 256 frames and double in size when full
+    capacity = 256
+    frame_ids = np.empty(capacity, dtype=np.int64)
+    times = np.empty(capacity, dtype=np.int64)
+    ball = np.empty((capacity, 3), dtype=dtype)
+    joint_arrays = {joint: np.empty((capacity, 3), dtype=dtype) for joint in joints or []}
+
+    N_frames = 0
+    with open(path, "rb") as f:
+        for frame in ijson.items(_NanToNullReader(f), "tracking.item", use_float=True):
+            player = frame["data"]["player"]
+            if joints is None:
+                joints = list(player)
+                joint_arrays = {joint: np.empty((capacity, 3), dtype=dtype) for joint in joints}
+
+            if N_frames == capacity:
+                capacity *= 2
+                frame_ids = _grow(frame_ids, capacity)
+                times = _grow(times, capacity)
+                ball = _grow(ball, capacity)
+                joint_arrays = {joint: _grow(joint_array, capacity) for joint, joint_array in joint_arrays.items()}
+
+            frame_ids[N_frames] = frame["frame"]
+            times[N_frames] = frame["time"]
+            ball[N_frames] = frame["data"]["ball"]
+            for joint, joint_array in joint_arrays.items():
+                joint_array[N_frames] = player[joint]
+            N_frames += 1
+
+    arrays["frame"] = frame_ids[:N_frames].copy()
+    arrays["time"] = times[:N_frames].copy()
+    arrays["ball"] = ball[:N_frames].copy()
+    arrays["joints"] = {joint: joint_array[:N_frames].copy() for joint, joint_array in joint_arrays.items()}
+    return arrays